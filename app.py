@@ -1,7 +1,10 @@
+import io
+import bisect
 import streamlit as st
 import pandas as pd
-import altair as alt
+import numpy as np
 import data_manager as dm
+import gpa_kernel as gk
 
 # --- SECTION 1: APP CONFIGURATION ---
 st.set_page_config(page_title="NUSGPA Calculator", layout="wide")
@@ -18,10 +21,64 @@ sem_mapping = {
     "Y5 S1": 9, "Y5 S2": 10, "Y6 S1": 11, "Y6 S2": 12,
     "Special Term": 99
 }
+GRADE_KEYS = tuple(grade_map.keys())
+SEM_LABELS = tuple(sem_mapping.keys())
+GRADE_DTYPE = pd.CategoricalDtype(GRADE_KEYS)
+# Indexed by categorical code; the trailing NaN catches code -1 (blank/unknown grade)
+GRADE_VALS = np.array([grade_map[k] for k in GRADE_KEYS] + [np.nan], dtype=np.float64)
+NON_GPA = ["CS", "CU", "IP"]
+# Same layout as GRADE_VALS: True for grades whose credits don't count towards GPA
+NON_GPA_MASK = np.zeros(len(GRADE_KEYS) + 1, dtype=bool)
+NON_GPA_MASK[[GRADE_KEYS.index(g) for g in NON_GPA]] = True
+# Indexed by semester number; index 0 and the gap up to Special Term stay blank
+SEM_LABEL_BY_INT = np.full(max(sem_mapping.values()) + 1, "", dtype="U12")
+for label, sem in sem_mapping.items(): SEM_LABEL_BY_INT[sem] = label
+# Per-semester summary fields; Semester is added per call with the source column's dtype
+SUMMARY_FIELDS = [("Sem Label", "U12"), ("Mods", "i4"), ("Sem GPA", "f8"), ("Cumulative GPA", "f8")]
+# Honours class by cumulative GPA: HONOURS_LABELS[i] applies from HONOURS_THRESHOLDS[i-1] upwards
+HONOURS_THRESHOLDS = (2.0, 3.0, 3.5, 4.0, 4.5)
+HONOURS_LABELS = (
+    "⚠️ Below Graduation Req", "📜 Pass", "🎓 Third Class",
+    "🥉 Second Class (Lower)", "🥈 Second Class (Upper)", "🥇 First Class Honours"
+)
+COURSE_COLS = ["Course", "Semester", "Grade", "Credits", "SU_Opt_Out"]
+COURSE_DTYPES = {"Course": str, "Semester": "int64", "Grade": str, "Credits": "float64", "SU_Opt_Out": bool}
+# Semester is left to inference on upload: forcing int64 would silently truncate a value like 1.5
+UPLOAD_DTYPES = {k: v for k, v in COURSE_DTYPES.items() if k != "Semester"}
+
+# Chart specs are plain Vega-Lite dicts built once; only the data changes between reruns
+GRADE_DIST_SPEC = {
+    "mark": {"type": "bar", "color": "#ffb060", "cornerRadiusTopLeft": 5, "cornerRadiusTopRight": 5},
+    "encoding": {
+        "x": {"field": "Grade", "type": "nominal", "sort": GRADE_KEYS, "title": None},
+        "y": {"field": "Count", "type": "quantitative", "title": "Count", "axis": {"tickMinStep": 1}},
+        "tooltip": [{"field": "Grade", "type": "nominal"}, {"field": "Count", "type": "quantitative"}]
+    },
+    "height": 250
+}
+TREND_SPEC = {
+    "encoding": {"x": {"field": "Sem Label", "type": "nominal", "sort": {"field": "Semester", "order": "ascending"}, "title": None}},
+    "layer": [
+        {
+            "mark": {"type": "bar", "opacity": 0.7, "color": "#60b4ff", "cornerRadiusTopLeft": 5, "cornerRadiusTopRight": 5},
+            "encoding": {
+                "y": {"field": "Sem GPA", "type": "quantitative", "scale": {"domain": [0, 5]}, "title": "GPA"},
+                "tooltip": [{"field": "Sem Label", "type": "nominal"}, {"field": "Sem GPA", "type": "quantitative"}, {"field": "Mods", "type": "quantitative"}]
+            }
+        },
+        {
+            "mark": {"type": "line", "color": "#ff0000", "point": True},
+            "encoding": {
+                "y": {"field": "Cumulative GPA", "type": "quantitative"},
+                "tooltip": [{"field": "Sem Label", "type": "nominal"}, {"field": "Cumulative GPA", "type": "quantitative"}]
+            }
+        }
+    ],
+    "height": 250
+}
 
 # --- SECTION 2: SESSION STATE ---
-if "courses" not in st.session_state:
-    st.session_state.courses = pd.DataFrame(columns=["Course", "Semester", "Grade", "Credits", "SU_Opt_Out"])
+if "course_rows" not in st.session_state: st.session_state.course_rows = []
 if "uploader_id" not in st.session_state: st.session_state.uploader_id = 0
 
 keys_defaults = {
@@ -31,18 +88,49 @@ keys_defaults = {
 for key, default in keys_defaults.items():
     if key not in st.session_state: st.session_state[key] = default
 
+# Grades are held as GRADE_DTYPE categoricals so analytics can use the codes directly
+def to_grade_codes(grades):
+    # Position of each grade in GRADE_KEYS; -1 for blank or unknown grades
+    if grades.dtype == GRADE_DTYPE: return grades.cat.codes.to_numpy()
+    return GRADE_DTYPE.categories.get_indexer(grades)
+
+def as_grade_category(grades):
+    return pd.Categorical.from_codes(to_grade_codes(grades), dtype=GRADE_DTYPE)
+
+# Courses live in a plain list of dicts so adding one is a cheap append.
+# The DataFrame view is memoized per session and only rebuilt when the list changes.
+def courses_df():
+    rows = st.session_state.course_rows
+    memo = st.session_state.get("courses_memo")
+    if memo is None or memo[0] is not rows or memo[1] != len(rows):
+        df = pd.DataFrame(rows, columns=COURSE_COLS)
+        # Non-empty frames infer these from the values; an empty one would be all-object
+        if not rows: df = df.astype(COURSE_DTYPES)
+        df["Grade"] = as_grade_category(df["Grade"])
+        memo = (rows, len(rows), df)
+        st.session_state.courses_memo = memo
+    return memo[2]
+
+def set_courses(df):
+    rows = df.to_dict("records")
+    st.session_state.course_rows = rows
+    st.session_state.courses_memo = (rows, len(rows), df)
+
+def courses_hash():
+    # Content fingerprint of courses_df(), used as the cache key for derived data
+    df = courses_df()
+    memo = st.session_state.get("courses_hash_memo")
+    if memo is None or memo[0] is not df:
+        memo = (df, pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        st.session_state.courses_hash_memo = memo
+    return memo[1]
+
 # --- SECTION 3: CALLBACKS ---
 def on_module_select():
     current_ay = st.session_state.get("ay_selector", dm.get_current_acad_year())
-    df_lookup = dm.get_modules_for_ay(current_ay)
-    
-    selection = st.session_state.search_selection
-    if selection and not df_lookup.empty:
-        matches = df_lookup[df_lookup["display_label"] == selection]
-        if not matches.empty:
-            row = matches.iloc[0]
-            st.session_state.course_name_input = row["moduleCode"]
-            st.session_state.credits_input = float(row["moduleCredit"])
+    info = dm.get_module_index(current_ay).get(st.session_state.search_selection)
+    if info:
+        st.session_state.course_name_input, st.session_state.credits_input = info
 
 def add_course_callback():
     name = st.session_state.course_name_input
@@ -54,22 +142,35 @@ def add_course_callback():
     
     final_name = name if name else (st.session_state.search_selection if st.session_state.search_selection else "Unknown Course")
     
-    new_row = pd.DataFrame([{
+    st.session_state.course_rows.append({
         "Course": final_name, "Semester": sem_int, "Grade": grade, 
         "Credits": credits, "SU_Opt_Out": su
-    }])
-    st.session_state.courses = pd.concat([st.session_state.courses, new_row], ignore_index=True)
+    })
     st.session_state.course_name_input = ""
     st.session_state.search_selection = None
 
 def reset_app_callback():
-    st.session_state.courses = pd.DataFrame(columns=["Course", "Semester", "Grade", "Credits", "SU_Opt_Out"])
-    st.session_state.last_loaded_hash = None
+    st.session_state.course_rows = []
+    st.session_state.last_loaded_file_id = None
     st.session_state.uploader_id += 1
     st.session_state.course_name_input = ""
     st.session_state.search_selection = None
 
 # --- SECTION 4: SIDEBAR ---
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def parse_uploaded(data):
+    # Keyed on the raw bytes, so the same file is only ever parsed once
+    try: return pd.read_csv(io.BytesIO(data), engine="pyarrow", dtype=UPLOAD_DTYPES)
+    except Exception:
+        # Blank or malformed cells don't fit the fixed dtypes; let pandas infer instead
+        df = pd.read_csv(io.BytesIO(data))
+        if "SU_Opt_Out" in df.columns: df["SU_Opt_Out"] = df["SU_Opt_Out"].astype(bool)
+        return df
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def courses_csv(df_hash, _courses):
+    return _courses.to_csv(index=False).encode('utf-8')
+
 st.sidebar.header("Data & Actions")
 
 unique_key = f"uploader_{st.session_state.uploader_id}"
@@ -77,23 +178,36 @@ uploaded_file = st.sidebar.file_uploader("Load CSV", type=["csv"], key=unique_ke
 if uploaded_file is None: st.sidebar.caption("📂 Load History (CSV)")
 
 if uploaded_file:
-    f_hash = hash(uploaded_file.getvalue())
-    if "last_loaded_hash" not in st.session_state or st.session_state.last_loaded_hash != f_hash:
+    # file_id is stable for an upload, so reruns don't need to read or hash the file
+    if st.session_state.get("last_loaded_file_id") != uploaded_file.file_id:
         try:
-            df_up = pd.read_csv(uploaded_file)
-            required_cols = {"Course", "Semester", "Grade", "Credits", "SU_Opt_Out"}
-            if required_cols.issubset(df_up.columns):
-                if "SU_Opt_Out" in df_up.columns: df_up["SU_Opt_Out"] = df_up["SU_Opt_Out"].astype(bool)
-                st.session_state.courses = df_up
-                st.session_state.last_loaded_hash = f_hash
-                st.rerun()
-            else: st.error("❌ Invalid CSV columns")
+            df_up = parse_uploaded(uploaded_file.getvalue())
+            if not set(COURSE_COLS).issubset(df_up.columns): st.error("❌ Invalid CSV columns")
+            else:
+                # Values that don't fit the course dtypes are refused rather than blanked
+                errors = []
+                unknown = df_up["Grade"][(to_grade_codes(df_up["Grade"]) < 0) & df_up["Grade"].notna()]
+                if not unknown.empty:
+                    errors.append(f"❌ Unknown grades in CSV: {', '.join(sorted(map(str, unknown.unique())))}")
+                # The inference fallback may leave these as text, so coerce them here
+                for col in ("Semester", "Credits"):
+                    num = pd.to_numeric(df_up[col], errors="coerce")
+                    bad = df_up[col][num.isna() & df_up[col].notna()]
+                    if not bad.empty:
+                        errors.append(f"❌ Non-numeric {col} in CSV: {', '.join(sorted(map(str, bad.unique())))}")
+                    df_up[col] = num
+                if errors: st.error("\n\n".join(errors))
+                else:
+                    df_up["Grade"] = as_grade_category(df_up["Grade"])
+                    set_courses(df_up)
+                    st.session_state.last_loaded_file_id = uploaded_file.file_id
+                    st.rerun()
         except Exception as e: st.error(f"Error: {e}")
 
-if not st.session_state.courses.empty:
+if st.session_state.course_rows:
     st.sidebar.download_button(
         "📥 Download CSV", 
-        st.session_state.courses.to_csv(index=False).encode('utf-8'), 
+        courses_csv(courses_hash(), courses_df()), 
         "myNUSGPA.csv", 
         "text/csv", 
         use_container_width=True
@@ -107,13 +221,13 @@ st.sidebar.markdown("---")
 
 with st.sidebar.expander("Add New Course", expanded=True):
     ay_list, default_ay = dm.get_ay_options()
-    dm.ensure_all_years_cached(ay_list)
     try: idx = ay_list.index(default_ay)
     except: idx = 0
     sel_ay = st.selectbox("AY Source", ay_list, index=idx, key="ay_selector", label_visibility="collapsed")
+    # Only the AY being searched needs its module table; others download when picked
+    dm.ensure_all_years_cached([sel_ay])
     
-    modules_df = dm.get_modules_for_ay(sel_ay)
-    opts = modules_df["display_label"].tolist() if not modules_df.empty else []
+    opts = dm.get_module_options(sel_ay)
 
     st.caption(f"Searching **{sel_ay}** database:")
     st.selectbox("Search", opts, index=None, placeholder="Search (e.g. CS1010)...", key="search_selection", on_change=on_module_select, label_visibility="collapsed")
@@ -122,11 +236,11 @@ with st.sidebar.expander("Add New Course", expanded=True):
     st.text_input("Course Code", key="course_name_input", label_visibility="collapsed", placeholder="Course Code")
     
     c1, c2 = st.columns([1.5, 1])
-    with c1: st.selectbox("Semester", list(sem_mapping.keys()), key="sem_input_label", label_visibility="collapsed")
+    with c1: st.selectbox("Semester", SEM_LABELS, key="sem_input_label", label_visibility="collapsed")
     with c2: st.number_input("Credits", 0.0, step=1.0, key="credits_input", label_visibility="collapsed")
     
     c3, c4 = st.columns([1, 1])
-    with c3: st.selectbox("Grade", list(grade_map.keys()), key="grade_input", label_visibility="collapsed")
+    with c3: st.selectbox("Grade", GRADE_KEYS, key="grade_input", label_visibility="collapsed")
     with c4: st.checkbox("Exercise S/U?", key="su_input")
     
     st.button("Add", on_click=add_course_callback, use_container_width=True)
@@ -143,11 +257,11 @@ with col_L:
     
     # We capture the edited dataframe
     edited_df = st.data_editor(
-        st.session_state.courses,
+        courses_df(),
         num_rows="dynamic",
         column_config={
             "SU_Opt_Out": st.column_config.CheckboxColumn("SU Option", default=False),
-            "Grade": st.column_config.SelectboxColumn("Grade", options=list(grade_map.keys()), required=True),
+            "Grade": st.column_config.SelectboxColumn("Grade", options=GRADE_KEYS, required=True),
             "Credits": st.column_config.NumberColumn("Credits", format="%.1f"),
             "Semester": st.column_config.NumberColumn("Semester", help="1=Y1S1, 2=Y1S2...", step=1)
         },
@@ -157,55 +271,72 @@ with col_L:
     )
     
     # [FIX] Immediate Update Logic
-    # 1. Check if the table differs from session state
-    if not edited_df.equals(st.session_state.courses):
+    # 1. Check if the table differs from session state (one hashing pass vs a cell-by-cell compare)
+    edited_hash = pd.util.hash_pandas_object(edited_df, index=False).values.tobytes()
+    if edited_hash != courses_hash():
         # 2. Update session state
-        st.session_state.courses = edited_df
+        set_courses(edited_df)
+        st.session_state.courses_hash_memo = (edited_df, edited_hash)
+        # 3. Rerun so the editor is re-keyed on the new data; without it the next edit is dropped
         st.rerun()
 
 # --- SECTION 6: ANALYTICS ---
-if not st.session_state.courses.empty:
-    df = st.session_state.courses.copy()
-    NON_GPA = ["CS", "CU", "IP"]
-    
-    df["Grade Value"] = df["Grade"].map(grade_map)
-    df["Calc_Credits"] = df.apply(lambda x: 0 if (x["SU_Opt_Out"] or x["Grade"] in NON_GPA) else x["Credits"], axis=1)
-    df["Q_Points"] = df["Grade Value"] * df["Calc_Credits"]
-    
-    summ = df.groupby("Semester").apply(lambda x: pd.Series({
-        "Term Credits": x["Calc_Credits"].sum(), "Term Points": x["Q_Points"].sum(), "Mods": len(x)
-    }), include_groups=False).reset_index()
-    
-    summ["Sem GPA"] = (summ["Term Points"] / summ["Term Credits"]).fillna(0)
-    summ["Cum Points"] = summ["Term Points"].cumsum()
-    summ["Cum Credits"] = summ["Term Credits"].cumsum()
-    summ["Cumulative GPA"] = (summ["Cum Points"] / summ["Cum Credits"]).fillna(0)
-    
-    cur_gpa = summ.iloc[-1]["Cumulative GPA"]
-    if cur_gpa >= 4.5: lbl = "🥇 First Class Honours"
-    elif cur_gpa >= 4.0: lbl = "🥈 Second Class (Upper)"
-    elif cur_gpa >= 3.5: lbl = "🥉 Second Class (Lower)"
-    elif cur_gpa >= 3.0: lbl = "🎓 Third Class"
-    elif cur_gpa >= 2.0: lbl = "📜 Pass"
-    else: lbl = "⚠️ Below Graduation Req"
-    
-    disp_sum = summ[["Semester", "Mods", "Sem GPA", "Cumulative GPA"]].round(2)
-    
-    # Grade Dist Chart Logic
-    def chart_grade(r):
-        if r["SU_Opt_Out"]: return "CS" if grade_map.get(r["Grade"],0)>=2.0 else "CU"
-        return r["Grade"]
-    
-    c_df = df.copy()
-    c_df["C_Grade"] = c_df.apply(chart_grade, axis=1)
-    dist = c_df["C_Grade"].value_counts().reset_index()
-    dist.columns = ["Grade", "Count"]
-    
-    d_chart = alt.Chart(dist).mark_bar(color='#ffb060', cornerRadiusTopLeft=5, cornerRadiusTopRight=5).encode(
-        x=alt.X('Grade', sort=list(grade_map.keys()), title=None),
-        y=alt.Y('Count', title='Count', axis=alt.Axis(tickMinStep=1)),
-        tooltip=['Grade', 'Count']
-    ).properties(height=250)
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def compute_analytics(df_hash, _courses):
+    # Cached on the content hash only, so reruns from unrelated widgets skip the pandas work
+    # Works on column arrays only; the cached input frame is never copied or extended
+    src = _courses
+    
+    grade_codes = to_grade_codes(src["Grade"])
+    gv = GRADE_VALS[grade_codes]
+    su = src["SU_Opt_Out"].eq(True).to_numpy()
+    credits = src["Credits"].to_numpy(dtype=float, na_value=np.nan)
+    
+    # sem_idx is each course's position in the sorted distinct semesters, -1 if blank
+    sem_idx, sems = pd.factorize(src["Semester"], sort=True)
+    sems = sems.to_numpy()
+    if gk.ENABLED:
+        tc, tp, mods = gk.term_totals(sem_idx, grade_codes, credits, su, NON_GPA_MASK, GRADE_VALS, len(sems))
+    else:
+        calc_c = np.where(su | NON_GPA_MASK[grade_codes], 0.0, credits)
+        # Per-semester sums; blank semesters and NaN credits/points are left out, as groupby did
+        in_sem = sem_idx >= 0
+        idx = sem_idx[in_sem]
+        tc = np.bincount(idx, weights=np.nan_to_num(calc_c[in_sem]), minlength=len(sems))
+        tp = np.bincount(idx, weights=np.nan_to_num(gv[in_sem] * calc_c[in_sem]), minlength=len(sems))
+        mods = np.bincount(idx, minlength=len(sems))
+    
+    cum_c, cum_p = np.cumsum(tc), np.cumsum(tp)
+    # GPA is 0 where there are no graded credits yet, or when no course has a semester
+    sem_gpa = np.divide(tp, tc, out=np.zeros(len(sems)), where=tc > 0)
+    cum_gpa = np.divide(cum_p, cum_c, out=np.zeros(len(sems)), where=cum_c > 0)
+    cur_gpa = cum_gpa[-1] if len(sems) else 0.0
+    
+    # One record per semester, shared by the Performance table and the Trend chart
+    sem_summary = np.empty(len(sems), dtype=[("Semester", sems.dtype)] + SUMMARY_FIELDS)
+    sem_summary["Semester"] = sems
+    # Only whole semester numbers in sem_mapping get a label; others (1.5, text) stay blank
+    labels = np.full(len(sems), "", dtype="U12")
+    if sems.dtype.kind in "iuf":
+        known = (sems >= 0) & (sems < len(SEM_LABEL_BY_INT)) & (sems % 1 == 0)
+        labels[known] = SEM_LABEL_BY_INT[sems[known].astype(int)]
+    sem_summary["Sem Label"] = labels
+    sem_summary["Mods"] = mods
+    sem_summary["Sem GPA"] = np.round(sem_gpa, 2)
+    sem_summary["Cumulative GPA"] = np.round(cum_gpa, 2)
+    
+    # Grade Dist Chart Logic: S/U'd mods show up as CS/CU
+    c_codes = np.where(su, np.where(gv >= 2.0, GRADE_KEYS.index("CS"), GRADE_KEYS.index("CU")), grade_codes)
+    counts = np.bincount(c_codes[c_codes >= 0], minlength=len(GRADE_KEYS))
+    dist = pd.DataFrame({"Grade": GRADE_KEYS, "Count": counts})
+    dist = dist[counts > 0].reset_index(drop=True)
+    return sem_summary, cur_gpa, dist
+
+if st.session_state.course_rows:
+    sem_summary, cur_gpa, dist = compute_analytics(courses_hash(), courses_df())
+    summary = pd.DataFrame(sem_summary)
+    
+    lbl = HONOURS_LABELS[bisect.bisect_right(HONOURS_THRESHOLDS, cur_gpa)]
     
     st.divider()
     with col_R:
@@ -215,21 +346,13 @@ if not st.session_state.courses.empty:
     c1, _, c2, _, c3 = st.columns([1, 0.1, 1, 0.1, 1], vertical_alignment="top")
     with c1:
         st.subheader("Performance")
-        st.dataframe(disp_sum, use_container_width=True, hide_index=True, height=250)
+        st.dataframe(summary, column_order=["Semester", "Mods", "Sem GPA", "Cumulative GPA"], use_container_width=True, hide_index=True, height=250)
     with c2:
         st.subheader("Grade Dist.")
-        st.altair_chart(d_chart, use_container_width=True)
+        st.vega_lite_chart(dist, GRADE_DIST_SPEC, use_container_width=True)
     with c3:
         st.subheader("Trend")
-        t_data = disp_sum.copy()
-        rev_map = {v: k for k, v in sem_mapping.items()}
-        t_data["Sem Label"] = t_data["Semester"].map(rev_map)
-        
-        base = alt.Chart(t_data).encode(x=alt.X('Sem Label', sort=alt.EncodingSortField(field="Semester", order="ascending"), title=None))
-        bar = base.mark_bar(opacity=0.7, color='#60b4ff', cornerRadiusTopLeft=5, cornerRadiusTopRight=5).encode(
-            y=alt.Y('Sem GPA', scale=alt.Scale(domain=[0,5]), title="GPA"), tooltip=['Sem Label', 'Sem GPA', 'Mods'])
-        line = base.mark_line(color="#ff0000", point=True).encode(y='Cumulative GPA', tooltip=['Sem Label', 'Cumulative GPA'])
-        st.altair_chart((bar+line).properties(height=250), use_container_width=True)
+        st.vega_lite_chart(summary, TREND_SPEC, use_container_width=True)
 
 else:
     st.info("**Welcome!** Start by adding your modules using the sidebar on the left.")
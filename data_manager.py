@@ -5,10 +5,17 @@ import json
 import time
 from datetime import datetime
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- CONFIGURATION ---
 START_YEAR = 2021 
 CACHE_DURATION = 86400 # 24 Hours in seconds
+REQUEST_TIMEOUT = (3, 10) # (connect, read) seconds
+
+# One pooled session for NUSMods, so successive downloads reuse the TLS connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2)))
 
 def get_current_acad_year():
     now = datetime.now()
@@ -16,6 +23,7 @@ def get_current_acad_year():
     if now.month >= 6: return f"{year}-{year+1}"
     else: return f"{year-1}-{year}"
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_ay_options():
     current = get_current_acad_year()
     current_start = int(current.split("-")[0])
@@ -42,12 +50,13 @@ def ensure_all_years_cached(ay_list):
             
     # 2. Batch Download (Only if needed)
     if missing_or_old:
+        refreshed = False
         with st.status("Refreshing module database...", expanded=True) as status:
             for i, ay in enumerate(missing_or_old):
                 st.write(f"Updating data for AY {ay}...")
                 url = f"https://api.nusmods.com/v2/{ay}/moduleInfo.json"
                 try:
-                    response = requests.get(url)
+                    response = _SESSION.get(url, timeout=REQUEST_TIMEOUT)
                     if response.status_code == 200:
                         full_data = response.json()
                         lite_data = []
@@ -60,9 +69,16 @@ def ensure_all_years_cached(ay_list):
                         
                         with open(f"modules_lite_{ay}.json", "w") as f:
                             json.dump(lite_data, f)
+                        refreshed = True
                 except Exception as e:
                     st.warning(f"Could not update {ay}. Keeping old data if available.")
             
+            # The files on disk are the persistent cache; drop in-memory copies so they get re-read
+            if refreshed:
+                get_modules_for_ay.clear()
+                get_module_options.clear()
+                get_module_index.clear()
+            
             status.update(label="Database up to date!", state="complete", expanded=False)
 
 @st.cache_data(show_spinner=False)
@@ -78,3 +94,16 @@ def get_modules_for_ay(ay):
         except Exception:
             return pd.DataFrame()
     return pd.DataFrame()
+
+@st.cache_resource(show_spinner=False)
+def get_module_options(ay):
+    # Immutable tuple, so cache_resource can hand back the same object on every rerun
+    df = get_modules_for_ay(ay)
+    return tuple(df["display_label"]) if not df.empty else ()
+
+@st.cache_resource(show_spinner=False)
+def get_module_index(ay):
+    # display_label -> (moduleCode, moduleCredit); shared read-only, never mutate the result
+    df = get_modules_for_ay(ay)
+    if df.empty: return {}
+    return dict(zip(df["display_label"], zip(df["moduleCode"], df["moduleCredit"].astype(float))))
@@ -0,0 +1,31 @@
+import os
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# --- CONFIGURATION ---
+# Opt-in: install numba and set NUSGPA_NUMBA=1 to aggregate with the jitted kernel
+ENABLED = numba is not None and os.environ.get("NUSGPA_NUMBA") == "1"
+
+def _term_totals(sem_idx, grade_codes, credits, su, non_gpa_mask, grade_vals, n_sems):
+    # One pass over the courses, summing graded credits, quality points and mod counts per semester.
+    # sem_idx is -1 for a blank semester (skipped, like groupby does); grade code -1 hits the
+    # trailing sentinel of non_gpa_mask / grade_vals.
+    term_c = np.zeros(n_sems)
+    term_p = np.zeros(n_sems)
+    mods = np.zeros(n_sems, dtype=np.int64)
+    for i in range(sem_idx.shape[0]):
+        s = sem_idx[i]
+        if s < 0: continue
+        mods[s] += 1
+        g = grade_codes[i]
+        if su[i] or non_gpa_mask[g] or np.isnan(credits[i]): continue
+        term_c[s] += credits[i]
+        qp = grade_vals[g] * credits[i]
+        if not np.isnan(qp): term_p[s] += qp
+    return term_c, term_p, mods
+
+term_totals = numba.njit(cache=True)(_term_totals) if ENABLED else _term_totals